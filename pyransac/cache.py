@@ -0,0 +1,122 @@
+from __future__ import division
+import collections
+import hashlib
+import os
+import pickle
+import numpy as n
+
+
+class ResultCache(object):
+    '''
+    Cache for the results of :py:meth:`pyransac.ransac.RansacFeature.image_search`,
+    keyed by a hash of the thresholded image foreground. Identical thresholded
+    frames (e.g. static scenes in a video or images processed again in a
+    batch job) are not processed again by the RANSAC loop.
+
+    The results are stored in memory with a :abbr:`LRU (Least Recently Used)`
+    eviction policy and, optionally, on disk.
+
+    Attributes:
+        maxsize(int): Max number of results stored in memory.
+        directory(str): Directory of the on-disk tier. If None, the results
+            are only stored in memory.
+        hits(int): Number of lookups that found a stored result.
+        misses(int): Number of lookups that did not find a stored result.
+    '''
+
+    def __init__(self,maxsize=128,directory=None):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._memory = collections.OrderedDict()
+
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @staticmethod
+    def key(foreground,params=()):
+        ''' Compute the cache key of a thresholded image.
+
+        Args:
+            foreground(numpy.ndarray): the thresholded image.
+            params(tuple): the detection parameters the result depends on.
+
+        Returns:
+            key(str): the hexadecimal digest of the foreground pixels,
+                of the image shape and of the parameters.
+        '''
+
+        h = hashlib.sha1()
+        h.update(repr((foreground.shape,params)).encode())
+        # Packing the foreground as bits to hash 8 pixels per byte
+        h.update(n.packbits(foreground > 0).tobytes())
+        return h.hexdigest()
+
+    def get(self,key):
+        ''' Look for a stored result.
+
+        Args:
+            key(str): the key computed with :py:meth:`ResultCache.key`.
+
+        Returns:
+            (tuple): the stored (feature,percent) tuple or None if the key
+                is not in the cache.
+        '''
+
+        if key in self._memory:
+            # Marking it as the most recently used
+            result = self._memory.pop(key)
+            self._memory[key] = result
+            self.hits += 1
+            return result
+
+        if self.directory is not None:
+            path = self._path(key)
+            if os.path.exists(path):
+                with open(path,'rb') as f:
+                    result = pickle.load(f)
+                self._store(key,result)
+                self.hits += 1
+                return result
+
+        self.misses += 1
+        return None
+
+    def put(self,key,result):
+        ''' Store a result.
+
+        Args:
+            key(str): the key computed with :py:meth:`ResultCache.key`.
+            result(tuple): the (feature,percent) tuple to be stored.
+        '''
+
+        self._store(key,result)
+
+        if self.directory is not None:
+            path = self._path(key)
+            tmp = path+'.tmp'
+            with open(tmp,'wb') as f:
+                pickle.dump(result,f,pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp,path)
+
+    def clear(self):
+        ''' Remove all the results stored in memory and reset the counters.
+        The on-disk tier is left untouched.
+        '''
+
+        self._memory.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._memory)
+
+    def _store(self,key,result):
+        self._memory[key] = result
+        while len(self._memory) > self.maxsize:
+            # Evicting the least recently used result
+            self._memory.popitem(last=False)
+
+    def _path(self,key):
+        return os.path.join(self.directory,key+'.pkl')
@@ -1,10 +1,45 @@
 from __future__ import division
 import abc
+import copy
+import itertools
 import numpy as n
 import scipy.linalg as linalg
 import scipy.optimize as opt
 import scipy.spatial.distance as dist
 
+def _bad_triples(p0,p1,p2,min_spacing,max_radius_ratio):
+    r'''
+    Check which triples of points are too close or (almost) collinear, 
+    i.e. have a side shorter than min_spacing or a circumradius 
+    :math:`R = \frac{abc}{2 \left| u \times v \right|}` larger than
+    max_radius_ratio times their longest side.
+    
+    Args:
+        p0,p1,p2 (numpy.ndarray): (...,2) numpy arrays of the points of the triples.
+        min_spacing (float): min distance between the points.
+        max_radius_ratio (float): max ratio between the circumradius and the
+            longest side.
+            
+    Returns:
+        mask (numpy.ndarray): a (...) boolean array, True for the bad triples.
+    '''
+    
+    u = p1 - p0
+    v = p2 - p0
+    w = p2 - p1
+    cross = n.abs(u[...,0]*v[...,1] - u[...,1]*v[...,0])
+    
+    sides = n.stack((n.hypot(u[...,0],u[...,1]),
+                     n.hypot(v[...,0],v[...,1]),
+                     n.hypot(w[...,0],w[...,1])),axis=-1)
+    too_close = n.min(sides,axis=-1) < min_spacing
+    
+    # R > ratio*spread, without dividing by the (possibly zero) cross product
+    too_flat = n.prod(sides,axis=-1) > \
+               2*max_radius_ratio*cross*n.max(sides,axis=-1)
+    
+    return too_close | too_flat
+
 class Feature(object):
     '''
     Abstract class that represents a feature to be used
@@ -12,6 +47,18 @@ class Feature(object):
     '''
     __metaclass__ = abc.ABCMeta
     
+    scalable = False
+    '''bool: True if the feature implements a scaled method, that returns
+    a copy of the feature scaled by a factor (needed by the pyramid search).'''
+    
+    vectorized = False
+    '''bool: True if the feature overrides :py:meth:`Feature.from_samples`
+    with a fit of many samples at once.'''
+    
+    print_interval = False
+    '''bool: True if the feature is unbounded, so that its print_feature
+    method also takes the [a,b] interval to be printed.'''
+    
     @abc.abstractmethod
     def __init__(self):
         pass
@@ -22,6 +69,54 @@ class Feature(object):
         
         pass
     
+    @classmethod
+    def degenerate(cls,samples):
+        '''
+        This method checks, before fitting the feature, which samples 
+        cannot define it. The default implementation rejects samples 
+        with repeated points.
+        
+        Args:
+            samples (numpy.ndarray): a (m,min_points,2) numpy array, each 
+                    element is a sample of points.
+                    
+        Returns:
+            mask (numpy.ndarray): a (m,) boolean array, True for the degenerate samples.
+        '''
+        
+        samples = n.asarray(samples)
+        k = samples.shape[1]
+        i,j = n.triu_indices(k,1)
+        same = n.all(samples[:,i] == samples[:,j],axis=-1)
+        return n.any(same,axis=-1)
+    
+    @classmethod
+    def from_samples(cls,samples):
+        '''
+        This method builds the features defined by many samples of points. 
+        The default implementation builds them one at a time, features
+        with a closed-form fit override it to fit all the samples at once.
+        
+        Args:
+            samples (numpy.ndarray): a (m,min_points,2) numpy array, each 
+                    element is a sample of points.
+                    
+        Returns:
+            features (list): the m features, None for the samples that
+                cannot define a feature.
+        '''
+        
+        features = []
+        for points,bad in zip(samples,cls.degenerate(samples)):
+            feature = None
+            if not(bad):
+                try:
+                    feature = cls(points)
+                except RuntimeError:
+                    pass
+            features.append(feature)
+        return features
+    
     @abc.abstractmethod
     def points_distance(self,points):
         ''' 
@@ -60,9 +155,41 @@ class Circle(Feature):
     min_points = 3
     '''int: Minimum number of points needed to define the circle (3).'''
     
+    scalable = True
+    
+    min_spacing = 2
+    '''float: Min distance between the points of a sample, in pixels. 
+    Closer points (e.g. adjacent pixels) give an unreliable circle.'''
+    
+    max_radius_ratio = 10
+    '''float: Max ratio between the radius of the circle through a sample
+    and the spread (longest side) of the sample. Almost collinear points
+    give huge circles, that are not worth scoring.'''
+    
     def __init__(self,points):
         self.radius,self.xc,self.yc = self.__gen(points)
     
+    @classmethod
+    def degenerate(cls,samples):
+        r'''
+        This method checks which samples cannot define a circle, i.e. 
+        the samples with points closer than :py:attr:`min_spacing` or 
+        (almost) collinear, whose circumradius 
+        :math:`R = \frac{abc}{2 \left| u \times v \right|}` is larger than
+        :py:attr:`max_radius_ratio` times their longest side.
+        
+        Args:
+            samples (numpy.ndarray): a (m,3,2) numpy array, each 
+                    element is a sample of points.
+                    
+        Returns:
+            mask (numpy.ndarray): a (m,) boolean array, True for the degenerate samples.
+        '''
+        
+        samples = n.asarray(samples,dtype=float)
+        return _bad_triples(samples[:,0],samples[:,1],samples[:,2],
+                            cls.min_spacing,cls.max_radius_ratio)
+    
 
     def __gen(self,points):
         '''
@@ -141,6 +268,23 @@ class Circle(Feature):
         
         return n.vstack((x,y))
     
+    def scaled(self,factor):
+        '''
+        This method returns a copy of the circle scaled by a factor.
+        
+        Args:
+            factor (float): the scale factor
+            
+        Returns:
+            feature (:py:class:`Circle`): the scaled circle
+        '''
+        
+        c = copy.copy(self)
+        c.radius = factor*self.radius
+        c.xc = factor*self.xc
+        c.yc = factor*self.yc
+        return c
+    
 class Exponential (Feature):
     '''
     Feature Class for an exponential curve :math:`y=ax^{k} + b`
@@ -148,9 +292,39 @@ class Exponential (Feature):
     
     min_points = 3
     
+    scalable = True
+    print_interval = True
+    
     def __init__(self,points):
         self.a,self.k,self.b = self.__gen(points)
     
+    @classmethod
+    def degenerate(cls,samples):
+        '''
+        This method checks which samples cannot define an exponential
+        curve, i.e. the samples whose points do not have distinct abscissae
+        and strictly monotonic ordinates.
+        
+        Args:
+            samples (numpy.ndarray): a (m,3,2) numpy array, each 
+                    element is a sample of points.
+                    
+        Returns:
+            mask (numpy.ndarray): a (m,) boolean array, True for the degenerate samples.
+        '''
+        
+        samples = n.asarray(samples,dtype=float)
+        
+        # Sorting the points of each sample by abscissa
+        order = n.argsort(samples[:,:,0],axis=1)
+        samples = n.take_along_axis(samples,order[:,:,n.newaxis],axis=1)
+        
+        dx = n.diff(samples[:,:,0],axis=1)
+        dy = n.sign(n.diff(samples[:,:,1],axis=1))
+        
+        monotonic = n.all(dy == dy[:,:1],axis=1) & (dy[:,0] != 0)
+        return n.any(dx <= 0,axis=1) | ~monotonic
+    
 
     def __gen(self,points):
         '''
@@ -231,3 +405,368 @@ class Exponential (Feature):
         
         return n.vstack((x,y))
     
+    def scaled(self,factor):
+        r'''
+        This method returns a copy of the exponential curve scaled by a factor
+        :math:`s`, i.e. :math:`y = a s^{1-k} x^{k} + s b`
+        
+        Args:
+            factor (float): the scale factor
+            
+        Returns:
+            feature (:py:class:`Exponential`): the scaled exponential curve
+        '''
+        
+        e = copy.copy(self)
+        e.a = self.a*n.power(factor,1-self.k)
+        e.b = factor*self.b
+        return e
+    
+class Line(Feature):
+    '''
+    Feature class for a Line :math:`n_x x + n_y y - c = 0`, where
+    :math:`(n_x,n_y)` is the unit normal of the line
+    '''
+    
+    min_points = 2
+    '''int: Minimum number of points needed to define the line (2).'''
+    
+    scalable = True
+    vectorized = True
+    print_interval = True
+    
+    min_spacing = 2
+    '''float: Min distance between the two points of a sample, in pixels. 
+    Closer points (e.g. adjacent pixels) give an unreliable direction.'''
+    
+    def __init__(self,points):
+        params,valid = self._fit(n.asarray(points,dtype=float)[n.newaxis])
+        if not(valid[0]):
+            raise RuntimeError('Line calculation not successful. Please\
+             check the input data, probable coincident points')
+        self.nx,self.ny,self.c = params[0]
+    
+    @classmethod
+    def degenerate(cls,samples):
+        '''
+        This method checks which samples cannot define a line, i.e. 
+        the samples with points closer than :py:attr:`min_spacing`.
+        
+        Args:
+            samples (numpy.ndarray): a (m,2,2) numpy array, each 
+                    element is a sample of points.
+                    
+        Returns:
+            mask (numpy.ndarray): a (m,) boolean array, True for the degenerate samples.
+        '''
+        
+        samples = n.asarray(samples,dtype=float)
+        d = samples[:,1] - samples[:,0]
+        return n.hypot(d[:,0],d[:,1]) < cls.min_spacing
+    
+    @staticmethod
+    def _fit(samples):
+        '''
+        Compute the normal and the offset of the lines through
+        many couples of points at once.
+        
+        Args:
+            samples (numpy.ndarray): a (m,2,2) numpy array, each element is
+                a couple of 2D points.
+                
+        Returns:
+            (tuple): A 2 elements tuple that contains the (m,3) array of the
+                [nx,ny,c] parameters and the (m,) boolean array of the valid ones.
+        '''
+        
+        d = samples[:,1] - samples[:,0]
+        norm = n.hypot(d[:,0],d[:,1])
+        valid = norm > 0
+        
+        # Avoiding the division by zero for coincident points
+        norm = n.where(valid,norm,1)
+        nx = -d[:,1]/norm
+        ny = d[:,0]/norm
+        c = nx*samples[:,0,0] + ny*samples[:,0,1]
+        
+        return (n.column_stack((nx,ny,c)),valid)
+    
+    @classmethod
+    def from_samples(cls,samples):
+        '''
+        This method builds the lines defined by many couples of points,
+        fitting them all at once.
+        
+        Args:
+            samples (numpy.ndarray): a (m,2,2) numpy array, each element is
+                a couple of 2D points.
+                    
+        Returns:
+            features (list): the m lines, None for the samples that
+                cannot define a line.
+        '''
+        
+        samples = n.asarray(samples,dtype=float)
+        params,valid = cls._fit(samples)
+        valid &= ~cls.degenerate(samples)
+        features = []
+        for (nx,ny,c),ok in zip(params,valid):
+            line = None
+            if ok:
+                line = cls.__new__(cls)
+                line.nx,line.ny,line.c = nx,ny,c
+            features.append(line)
+        return features
+    
+    def points_distance(self,points):
+        r'''
+        Compute the distance of the points from the feature
+        
+        :math:`d = \left| n_x x_i + n_y y_i - c \right|`
+        
+        Args:
+            points (numpy.ndarray): a (n,2) numpy array, each row is a 2D Point.
+            
+        Returns:
+            d (numpy.ndarray): the computed distances of the points from the feature.
+        
+        '''
+        
+        return n.abs(points[:,0]*self.nx + points[:,1]*self.ny - self.c)
+    
+    def print_feature(self, num_points, a, b):
+        '''
+        This method returns an array of x,y coordinates for
+        points that are in the feature, in the interval [a,b] of the 
+        line abscissa measured from the point nearest to the origin.
+        
+        Args:
+            num_points (numpy.ndarray): the number of points to be returned
+            a (float): left end of the interval
+            b (float): right end of the interval
+            
+        Returns:
+            coords (numpy.ndarray): a num_points x 2 numpy array that contains 
+            the points coordinates  
+        '''
+        
+        t = n.linspace(a,b,num_points)
+        x = self.c*self.nx - t*self.ny
+        y = self.c*self.ny + t*self.nx
+        
+        return n.vstack((x,y))
+    
+    def scaled(self,factor):
+        '''
+        This method returns a copy of the line scaled by a factor.
+        
+        Args:
+            factor (float): the scale factor
+            
+        Returns:
+            feature (:py:class:`Line`): the scaled line
+        '''
+        
+        l = copy.copy(self)
+        l.c = factor*self.c
+        return l
+    
+class Ellipse(Feature):
+    '''
+    Feature class for an Ellipse, as the conic 
+    :math:`A x^2 + B xy + C y^2 + D x + E y + F = 0` with :math:`B^2 - 4AC < 0`
+    '''
+    
+    min_points = 5
+    '''int: Minimum number of points needed to define the ellipse (5).'''
+    
+    scalable = True
+    vectorized = True
+    
+    min_spacing = 2
+    '''float: Min distance between the points of a sample, in pixels. 
+    Closer points (e.g. adjacent pixels) give an unreliable ellipse.'''
+    
+    max_radius_ratio = 20
+    '''float: Max ratio between the radius of the circle through a triple
+    of points of a sample and the spread (longest side) of the triple. 
+    It is larger than :py:attr:`Circle.max_radius_ratio`, since three points
+    on the flat side of an elongated ellipse are almost collinear.'''
+    
+    def __init__(self,points):
+        conics,valid = self._fit(n.asarray(points,dtype=float)[n.newaxis])
+        if not(valid[0]):
+            raise RuntimeError('Ellipse calculation not successful. The\
+             conic through the points is not an ellipse')
+        self.conic = conics[0]
+    
+    @classmethod
+    def degenerate(cls,samples):
+        '''
+        This method checks which samples cannot define an ellipse, 
+        i.e. the samples with points closer than :py:attr:`min_spacing` or 
+        with three (almost) collinear points, whose circumradius is larger 
+        than :py:attr:`max_radius_ratio` times their longest side.
+        
+        Args:
+            samples (numpy.ndarray): a (m,5,2) numpy array, each 
+                    element is a sample of points.
+                    
+        Returns:
+            mask (numpy.ndarray): a (m,) boolean array, True for the degenerate samples.
+        '''
+        
+        samples = n.asarray(samples,dtype=float)
+        
+        # All the triples of points of a sample
+        i,j,k = n.array([t for t in itertools.combinations(range(cls.min_points),3)]).T
+        bad = _bad_triples(samples[:,i],samples[:,j],samples[:,k],
+                           cls.min_spacing,cls.max_radius_ratio)
+        
+        return n.any(bad,axis=1)
+    
+    @staticmethod
+    def _fit(samples):
+        '''
+        Compute the conics through many samples of five points at once. 
+        The points are normalized (zero mean and unit mean distance from
+        the origin) for the numerical conditioning of the linear system.
+        
+        Args:
+            samples (numpy.ndarray): a (m,5,2) numpy array, each element is
+                a sample of five 2D points.
+                
+        Returns:
+            (tuple): A 2 elements tuple that contains the (m,6) array of the
+                unit norm [A,B,C,D,E,F] conic coefficients and the (m,) 
+                boolean array of the conics that are real ellipses.
+        '''
+        
+        m = samples.shape[0]
+        mean = samples.mean(axis=1)
+        scale = n.hypot(*(samples - mean[:,n.newaxis]).transpose(2,0,1)).mean(axis=1)
+        scale = n.where(scale > 0,scale,1)
+        q = (samples - mean[:,n.newaxis])/scale[:,n.newaxis,n.newaxis]
+        x = q[...,0]
+        y = q[...,1]
+        
+        # The conic coefficients are the null space of the (5,6) system
+        M = n.stack((x*x,x*y,y*y,x,y,n.ones_like(x)),axis=-1)
+        a,b,c,d,e,f = n.linalg.svd(M)[2][:,-1].T
+        Q = n.array([[a,b/2,d/2],
+                     [b/2,c,e/2],
+                     [d/2,e/2,f]]).transpose(2,0,1)
+        
+        # Back to the original coordinates: Q = T^t Q' T with q = T p
+        T = n.zeros((m,3,3))
+        T[:,0,0] = T[:,1,1] = 1/scale
+        T[:,:2,2] = -mean/scale[:,n.newaxis]
+        T[:,2,2] = 1
+        Q = n.einsum('mji,mjk,mkl->mil',T,Q,T)
+        
+        conics = n.column_stack((Q[:,0,0],2*Q[:,0,1],Q[:,1,1],
+                                 2*Q[:,0,2],2*Q[:,1,2],Q[:,2,2]))
+        conics /= n.linalg.norm(conics,axis=1)[:,n.newaxis]
+        
+        # A real ellipse has B^2-4AC < 0 and det(Q) of opposite sign to A
+        A,B,C = conics[:,0],conics[:,1],conics[:,2]
+        valid = (B*B - 4*A*C < 0) & (A*n.linalg.det(Q) < 0)
+        
+        return (conics,valid)
+    
+    @classmethod
+    def from_samples(cls,samples):
+        '''
+        This method builds the ellipses defined by many samples of five 
+        points, fitting them all at once.
+        
+        Args:
+            samples (numpy.ndarray): a (m,5,2) numpy array, each element is
+                a sample of five 2D points.
+                    
+        Returns:
+            features (list): the m ellipses, None for the samples that
+                cannot define an ellipse.
+        '''
+        
+        samples = n.asarray(samples,dtype=float)
+        conics,valid = cls._fit(samples)
+        valid &= ~cls.degenerate(samples)
+        features = []
+        for conic,ok in zip(conics,valid):
+            ellipse = None
+            if ok:
+                ellipse = cls.__new__(cls)
+                ellipse.conic = conic
+            features.append(ellipse)
+        return features
+    
+    def points_distance(self,points):
+        r'''
+        Compute the Sampson distance of the points from the feature, i.e.
+        the first order approximation of their geometric distance
+        
+        :math:`d = \frac{\left| Q(x_i,y_i) \right|}{\left\| \nabla Q(x_i,y_i) \right\|}`
+        
+        Args:
+            points (numpy.ndarray): a (n,2) numpy array, each row is a 2D Point.
+            
+        Returns:
+            d (numpy.ndarray): the computed distances of the points from the feature.
+        
+        '''
+        
+        A,B,C,D,E,F = self.conic
+        x = points[:,0]
+        y = points[:,1]
+        
+        q = A*x*x + B*x*y + C*y*y + D*x + E*y + F
+        gx = 2*A*x + B*y + D
+        gy = B*x + 2*C*y + E
+        
+        return n.abs(q)/n.maximum(n.hypot(gx,gy),n.finfo(float).tiny)
+    
+    def print_feature(self, num_points):
+        '''
+        This method returns an array of x,y coordinates for
+        points that are in the feature.
+        
+        Args:
+            num_points (numpy.ndarray): the number of points to be returned
+            
+        Returns:
+            coords (numpy.ndarray): a num_points x 2 numpy array that contains 
+            the points coordinates  
+        '''
+        
+        A,B,C,D,E,F = self.conic
+        
+        # Center, where the gradient of the conic vanishes
+        xc,yc = n.linalg.solve([[2*A,B],[B,2*C]],[-D,-E])
+        f0 = A*xc*xc + B*xc*yc + C*yc*yc + D*xc + E*yc + F
+        
+        # Axes along the eigenvectors of the quadratic part
+        w,v = n.linalg.eigh([[A,B/2],[B/2,C]])
+        axes = n.sqrt(-f0/w)
+        
+        theta = n.linspace(0,2*n.pi,num_points)
+        coords = n.dot(v,n.vstack((axes[0]*n.cos(theta),axes[1]*n.sin(theta))))
+        
+        return coords + n.array([[xc],[yc]])
+    
+    def scaled(self,factor):
+        '''
+        This method returns a copy of the ellipse scaled by a factor.
+        
+        Args:
+            factor (float): the scale factor
+            
+        Returns:
+            feature (:py:class:`Ellipse`): the scaled ellipse
+        '''
+        
+        e = copy.copy(self)
+        A,B,C,D,E,F = self.conic
+        conic = n.array([A,B,C,D*factor,E*factor,F*factor**2])
+        e.conic = conic/n.linalg.norm(conic)
+        return e
@@ -1,8 +1,20 @@
 from __future__ import division
+import itertools
+import os
+import pickle
+import timeit
 import cv2
 from matplotlib import pyplot as plt
 import numpy as n
 import numpy.random as rnd
+from pyransac.sources import as_source
+
+
+_SAMPLE_BLOCK = 64
+'''int: Max number of samples drawn and fitted at once in the RANSAC loop.'''
+
+_PYRAMID_THRESHOLD = 50
+'''int: Threshold of the downsampled levels of the pyramid search.'''
 
 
 class RansacFeature(object):
@@ -19,66 +31,181 @@ class RansacFeature(object):
                    (can be an integer from 1 to 254).
         dst(float): the distance of the inliers pixels from the feature (i.e.\
              a pixel is considered an inlier if its distance is < dst).
+        cache(:py:class:`pyransac.cache.ResultCache`): cache of the results of\
+             :py:meth:`image_search`. If None, every image is processed.
+        pyramid_levels(int): number of downsampled levels used by :py:meth:`image_search`.\
+             If > 0 the feature is detected on the coarsest level and then refined\
+             on the finer ones using only the pixels near it.
+        refine_it(int): Max number of iterations for the RANSAC loop at each\
+             refinement level of the pyramid search.
+        time_budget(float): Max time in seconds for a detection. When it is\
+             over the best feature found so far is returned. If None the\
+             detection is bounded only by the number of iterations.
+        frames_converged(numpy.ndarray): the converged flags (see :py:meth:`detect_feature`)\
+             of the frames of the last :py:meth:`video_processing` run.
+        rng(numpy.random.Generator): the random generator of the samples. It is\
+             built from the seed argument, that can be None, an integer, a\
+             :py:class:`numpy.random.SeedSequence` or a :py:class:`numpy.random.Generator`.\
+             Each frame of :py:meth:`video_processing` uses its own child stream.
     '''
     
-    def __init__(self,feature,max_it=100,inliers_percent=0.6, threshold = 100, dst = 10):
+    def __init__(self,feature,max_it=100,inliers_percent=0.6, threshold = 100, dst = 10,
+                 cache=None,pyramid_levels=0,refine_it=20,time_budget=None,seed=None):
         self.feature = feature
         self.max_it = max_it 
         self.inliers_percent = inliers_percent 
         self.threshold = threshold
         self.dst = dst
+        self.cache = cache
+        self.pyramid_levels = pyramid_levels
+        self.refine_it = refine_it
+        
+        if pyramid_levels > 0 and not(feature.scalable):
+            raise ValueError('The pyramid search needs a feature that supports\
+                             scaling, {0} does not'.format(feature.__name__))
+        self.time_budget = time_budget
+        self.frames_converged = None
+        
+        if isinstance(seed,rnd.Generator):
+            # Deriving the seed from the state of the generator, so that
+            # the child streams are reproducible too
+            seed = seed.integers(2**63,size=4)
+        if not(isinstance(seed,rnd.SeedSequence)):
+            seed = rnd.SeedSequence(seed)
+        self._seed_seq = seed
+        self.rng = rnd.default_rng(seed)
+        
+        # The frame streams have their own branch of the seed tree, so they
+        # never collide with the generators returned by spawn
+        self._frame_seq = seed.spawn(1)[0]
+    
+    def spawn(self,count):
+        ''' This method returns independent random generators, e.g. for
+        parallel workers.
+        
+        Args:
+            count(int): the number of generators.
+            
+        Returns:
+            (list): the list of :py:class:`numpy.random.Generator` objects.
+        '''
+        return [rnd.default_rng(s) for s in self._seed_seq.spawn(count)]
+    
+    def _frame_rng(self,index):
+        ''' Random generator of a frame of :py:meth:`video_processing`. It 
+        depends only on the seed and on the frame index, so sharded and 
+        resumed runs draw the same samples of a single run.
+        '''
+        seed = rnd.SeedSequence(self._frame_seq.entropy,
+                                spawn_key=self._frame_seq.spawn_key+(index,))
+        return rnd.default_rng(seed)
         
-    def detect_feature(self,pixels):
+    def detect_feature(self,pixels,dst=None,max_it=None,time_budget=None,rng=None,
+                       return_converged=False):
         ''' This method look for the feature inside a set of points.
         
+        If the time budget is over before the end of the loop, the best 
+        feature found so far is returned and the detection is flagged as 
+        not converged. The deadline is enforced even if no feature has been
+        found yet: then the returned feature is None.
+        
         Args:
             points(numpy.ndarray): a (n,n)-shaped numpy array of points.
+            dst(float): the inliers distance. If None :py:attr:`dst` is used.
+            max_it(int): Max number of iterations. If None :py:attr:`max_it` is used.
+            time_budget(float): Max time in seconds. If None :py:attr:`time_budget` is used.
+            rng(numpy.random.Generator): the random generator of the samples. If None
+                :py:attr:`rng` is used.
+            return_converged(bool): if True the converged flag is returned too.
             
         Returns:
             (list): list containing:
             
-                feature(:py:attr:`pyransac.ransac.RansacFeature.feature`): The detected feature object.
+                feature(:py:attr:`pyransac.ransac.RansacFeature.feature`): The detected feature object \
+                    (None if the time budget is over before any feature is found).
                 
                 percent(float): The percentage of "fitness" (i.e inliers/total_points) of the feature detected \
                     in the image.
+                    
+                converged(bool): only if return_converged is True. False if the loop was \
+                    stopped by the time budget.
             
+        Raises:
+            ValueError: If no sample in the iterations budget defines a feature.
         '''
         
+        if dst is None:
+            dst = self.dst
+        if max_it is None:
+            max_it = self.max_it
+        if time_budget is None:
+            time_budget = self.time_budget
+        if rng is None:
+            rng = self.rng
+        
+        deadline = None
+        if time_budget is not None:
+            deadline = timeit.default_timer() + time_budget
+        
         # -- Starting Loop -- #
         
-        # Pre-allocating guess points 
-        pts = n.zeros((self.feature.min_points,2))
+        # Features with a vectorized fit are generated a block at a time,
+        # the others one at a time, only if the loop gets to them
+        vectorized = self.feature.vectorized
+        
+        # Current block of samples
+        samples = []
+        g = 0
         
         # Starting iterations
         it = 0
         
         # Current percent of inliers over the total points
         percent = 0
+        feature = None
+        converged = True
         
 
-        while not(percent>self.inliers_percent or it>self.max_it):
+        while not(percent>self.inliers_percent or it>max_it):
             
-            # Guess three pixels from the non-zero ones
-            pts = pixels[rnd.randint(n.size(pixels[:,0]),size=self.feature.min_points)]
+            # Stopping at the deadline
+            if deadline is not None and timeit.default_timer() > deadline:
+                converged = False
+                break
             
-          
+            if g == len(samples):
+                # Guess a block of samples from the non-zero pixels and 
+                # reject at once those that cannot define the feature
+                size = int(min(_SAMPLE_BLOCK,max_it+1-it))
+                idx = rng.integers(pixels.shape[0],size=(size,self.feature.min_points))
+                samples = pixels[idx]
+                if vectorized:
+                    guesses = self.feature.from_samples(samples)
+                else:
+                    rejected = self.feature.degenerate(samples)
+                g = 0
             
-            # Generating Circle from the three given points
-            try:
-                guess_feature = self.feature(pts)
-            except RuntimeError: # If the three points are collinear the circle cannot be computed
-                continue
-            # Compute distance of all non-zero points from the circumference 
-            distances = guess_feature.points_distance(pixels)
-            
-            # Count how many points are inliers (i.e. near the circle)
-            inliers = n.size(n.nonzero(distances <= self.dst)[0])
-                        
-            #Compute the percentage
-            percent_new = inliers/n.size(pixels)
+            if vectorized:
+                guess_feature = guesses[g]
+            else:
+                guess_feature = None
+                if not(rejected[g]):
+                    try:
+                        guess_feature = self.feature(samples[g])
+                    except RuntimeError: # If the points are collinear the feature cannot be computed
+                        pass
+            g = g+1
             
+            # Rejected samples count as iterations too, so that 
+            # the loop always ends
             it = it+1
             
+            if guess_feature is None:
+                continue
+            
+            # Compute the percentage of points near the circumference
+            percent_new = _percent(guess_feature,pixels,dst)
+            
             if percent_new > percent:
                 # Update if better approximation
                 percent = percent_new
@@ -90,21 +217,36 @@ class RansacFeature(object):
         #     warnings.warn('''Max Iterations number reached. The current percentage of fitness is {0}'''\
         #                   .format(percent),RuntimeWarning)
         #=======================================================================s
+        
+        if feature is None and converged:
+            raise ValueError('No feature found in {0} iterations: all the samples\
+                             were degenerate'.format(it))
+        
+        if return_converged:
+            return (feature,percent,converged)
         return (feature,percent)
     
-    def image_search(self,image):
+    def image_search(self,image,time_budget=None,rng=None,return_converged=False):
         ''' This method look for the feature inside a grayscale image.
         
         Args:
             image(numpy.ndarray): the image where to detect the circle.
+            time_budget(float): Max time in seconds for the detection (see
+                :py:meth:`detect_feature`). If None :py:attr:`time_budget` is used.
+            rng(numpy.random.Generator): the random generator of the samples. If None
+                :py:attr:`rng` is used.
+            return_converged(bool): if True the converged flag is returned too.
 
         Returns:
             (list): list containing:
             
                 feature (:py:class:`pyransac.ransac.RansacFeature.feature`): The detected feature object
+                (None if the time budget is over before any feature is found)
                 
                 percent (float): the percentage of 'fitness' (i.e.inliers/total_points)
                 of the detected feature
+                
+                converged (bool): only if return_converged is True, see :py:meth:`detect_feature`.
             
         Raises:
             ValueError: If the thresholded image is completely empty (all pixels intensities
@@ -117,7 +259,8 @@ class RansacFeature(object):
 
         
         # Normalization
-        image = cv2.normalize(image,image, alpha=0,norm_type=cv2.NORM_MINMAX, beta = 255)
+        # (not in place, the image can be a read-only or user-owned frame)
+        image = cv2.normalize(image,None, alpha=0,norm_type=cv2.NORM_MINMAX, beta = 255)
         
         # Thresholding
         _ret,image = cv2.threshold(image,self.threshold,255,cv2.THRESH_BINARY)
@@ -126,63 +269,452 @@ class RansacFeature(object):
         pixels = n.where(image>0)
         
         #Thresholded image can be empty
-        if not(pixels):
+        if not(pixels[0].size):
             raise ValueError('Thresholded image is completely empty.\
                             The threshold argument is too high or the image\
                             is totally black')
         
+        # Looking for an already computed result
+        if self.cache is not None:
+            key = self.cache.key(image,self._params())
+            result = self.cache.get(key)
+            if result is not None:
+                # Only converged results are stored
+                return result+(True,) if return_converged else result
+        
         # Orienting correctly the points in a (n,2) shape
         # needed because of arguments of Circle.points_distance()
         pixels = n.transpose(n.vstack([pixels[0],pixels[1]]))
         
-        return self.detect_feature(pixels)
+        if time_budget is None:
+            time_budget = self.time_budget
+        
+        if self.pyramid_levels > 0:
+            feature,percent,converged = self._pyramid_search(image,pixels,time_budget,rng)
+        else:
+            feature,percent,converged = self.detect_feature(pixels,time_budget=time_budget,
+                                                            rng=rng,return_converged=True)
         
+        # Results cut by the deadline are not stored, a later search
+        # could find a better feature
+        if self.cache is not None and converged:
+            self.cache.put(key,(feature,percent))
+        
+        if return_converged:
+            return (feature,percent,converged)
+        return (feature,percent)
     
-    def video_processing(self,videofile,save_frames=False):
+    def _pyramid_search(self,image,pixels,time_budget=None,rng=None):
+        ''' Coarse-to-fine search of the feature. The thresholded image is 
+        downsampled :py:attr:`pyramid_levels` times, the feature is detected
+        on the coarsest level and then the scaled feature is refined on each
+        finer level with the pixels that lie near it.
+        
+        Args:
+            image(numpy.ndarray): the thresholded image.
+            pixels(numpy.ndarray): the (n,2) array of its non-zero pixels.
+            time_budget(float): Max time in seconds for the whole search.
+            rng(numpy.random.Generator): the random generator of the samples.
+            
+        Returns:
+            (tuple): the (feature,percent,converged) tuple, as :py:meth:`detect_feature`.
+        '''
+        
+        # Building the pyramid, from the finest to the coarsest level
+        levels = [pixels]
+        for _l in range(self.pyramid_levels):
+            # Thresholding the blurred level back to binary: isolated pixels
+            # (at most 36 after pyrDown) are dropped, while one pixel wide 
+            # lines (at least 64) are kept
+            image = cv2.pyrDown(image)
+            _ret,image = cv2.threshold(image,_PYRAMID_THRESHOLD,255,cv2.THRESH_BINARY)
+            level_pixels = n.transpose(n.nonzero(image))
+            # Stop if the level is too small for a meaningful search
+            if level_pixels.shape[0] < 2*self.feature.min_points:
+                break
+            levels.append(level_pixels)
+        
+        coarsest = len(levels)-1
+        if coarsest == 0:
+            return self.detect_feature(pixels,time_budget=time_budget,rng=rng,
+                                       return_converged=True)
+        
+        deadline = None
+        if time_budget is not None:
+            deadline = timeit.default_timer() + time_budget
+        
+        feature,_coarse_percent,converged = self.detect_feature(levels[coarsest],
+                                                                dst=max(self.dst/2**coarsest,1),
+                                                                time_budget=time_budget,rng=rng,
+                                                                return_converged=True)
+        if feature is None:
+            return (None,0,False)
+        
+        for l in range(coarsest-1,-1,-1):
+            feature = feature.scaled(2)
+            dst = max(self.dst/2**l,1)
+            
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - timeit.default_timer()
+                if remaining <= 0:
+                    # Scaling the feature up to full resolution 
+                    # without refining it
+                    feature = feature.scaled(2**l)
+                    converged = False
+                    break
+            
+            # Only the pixels near the scaled feature
+            distances = feature.points_distance(levels[l]).ravel()
+            band = levels[l][distances <= 2*(dst+1)]
+            if band.shape[0] < self.feature.min_points:
+                continue
+            
+            try:
+                refined,percent,refine_converged = self.detect_feature(band,dst=dst,
+                                                                       max_it=self.refine_it,
+                                                                       time_budget=remaining,rng=rng,
+                                                                       return_converged=True)
+            except ValueError:
+                continue
+            converged = converged and refine_converged
+            if refined is not None and percent > _percent(feature,band,dst):
+                feature = refined
+        
+        return (feature,_percent(feature,pixels,self.dst),converged)
+    
+    def _params(self):
+        ''' Parameters the result of :py:meth:`image_search` depends on,
+        used to build the keys of :py:attr:`cache`.
+        '''
+        return (self.feature.__module__,self.feature.__name__,self.max_it,
+                self.inliers_percent,self.threshold,self.dst,
+                self.pyramid_levels,self.refine_it)
+        
+    
+    def video_processing(self,videofile,save_frames=False,start=0,stop=None,
+                         checkpoint=None,checkpoint_every=100,time_budget=None,
+                         drop_frames=False,fps=None):
         ''' This method look for the feature inside each frame of 
-        a video. 
+        a video. The frames can come from a video file, a 
+        :py:class:`cv2.VideoCapture` object, a stack of frames in memory
+        or any :py:class:`pyransac.sources.FrameSource` (e.g. a raw 
+        memory-mapped file, see :py:func:`pyransac.sources.raw_source`), 
+        including sequential sources of unknown length such as iterators
+        of frames or live cameras, that are processed until exhausted.
+        
+        Only the frames in the range [start,stop) are processed, so that a
+        long video can be split in shards processed independently (see
+        :py:func:`pyransac.ransac.merge_shards`). If a checkpoint file is
+        given, the progress is periodically saved into it and an interrupted
+        run is resumed from the last processed frame.
+        
+        For real-time processing each detection can be bounded by a time 
+        budget and, if the processing falls behind the video frame rate, 
+        frames are dropped. The converged flags of the frames are stored 
+        in :py:attr:`frames_converged`.
         
         Args:
-            videofile (str): path string of the video file.
+            videofile (str): path string of the video file or any object
+                accepted by :py:func:`pyransac.sources.as_source`.
+            save_frames (bool): if True each frame is saved as an image with
+                the detected feature superimposed.
+            start (int): index of the first frame to process. It must be 0
+                for sources that cannot seek.
+            stop (int): index of the frame after the last one to process. If
+                None the video is processed until its end. Sources of unknown 
+                length stop earlier if exhausted.
+            checkpoint (str): path of the checkpoint file. If None no 
+                checkpoint is saved. The source must have a stable identity
+                (see :py:meth:`pyransac.sources.FrameSource.signature`).
+            checkpoint_every (int): number of frames processed between two
+                checkpoint savings.
+            time_budget (float): Max time in seconds for the detection in each
+                frame. If None :py:attr:`time_budget` is used.
+            drop_frames (bool): if True the frames are skipped (and their
+                feature is None) while the processing is behind the video 
+                frame rate. Frames are never dropped if the frame rate is
+                unknown (e.g. for numpy arrays, unless fps is given).
+            fps (float): the frame rate of the video. If None the frame rate
+                of the source is used.
 
         Returns:
-            fs (numpy.ndarray): the array of features detected
+            fs (numpy.ndarray): the array of features detected in the frames
+                of the range [start,stop)
 
             
         Raises:
-            ValueError: If the thresholded image is completely empty (all pixels intensities
-                        == 0, a ValueError is raised).
+            ValueError: If the frame range is not valid, if the checkpoint
+                file refers to a different frame range, video or detection
+                parameters or if a start frame or a checkpoint is given for
+                a source of unknown length.
+            RuntimeError: If a frame cannot be retrieved from the video.
         '''
-        video = cv2.VideoCapture(videofile)
-        nframes = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+        video = as_source(videofile)
+        nframes = video.frame_count()
         
-        #Pre-allocating dataset for feature array
-        fs = n.empty(nframes,dtype=self.feature)
+        if nframes is None:
+            # Sequential sources can neither seek nor be resumed
+            if start != 0 or checkpoint is not None:
+                raise ValueError('A source of unknown length can only be\
+                                 processed from its first frame, without checkpoint')
+            if stop is not None and not(0 < stop):
+                raise ValueError('Frame range [0,{0}) is not valid'.format(stop))
+        else:
+            if stop is None or stop > nframes:
+                stop = nframes
+                
+            if not(0 <= start < stop):
+                raise ValueError('Frame range [{0},{1}) is not valid for a video\
+                                 of {2} frames'.format(start,stop,nframes))
+        
+        # Resuming from the checkpoint, if any
+        state = None
+        if checkpoint is not None:
+            checkpoint = os.fspath(checkpoint)
+            header = {'start':start,'stop':stop,'params':self._params(),
+                      'source':video.signature()}
+            state = _load_checkpoint(checkpoint,truncate=True)
+            
+        if state is not None:
+            if (state['start'],state['stop']) != (start,stop):
+                raise ValueError('Checkpoint {0} refers to frame range [{1},{2})'\
+                                 .format(checkpoint,state['start'],state['stop']))
+            if (state['params'],state['source']) != (header['params'],header['source']):
+                raise ValueError('Checkpoint {0} was saved with a different video\
+                                 or different detection parameters'.format(checkpoint))
+            fs = state['features']
+            converged = state['converged']
+            current = state['next']
+        else:
+            #Pre-allocating dataset for feature array (grown while 
+            # processing if the number of frames is unknown)
+            size = stop-start if stop is not None else 0
+            fs = n.empty(size,dtype=self.feature)
+            converged = n.ones(size,dtype=bool)
+            current = start
+            if checkpoint is not None:
+                _init_checkpoint(checkpoint,header)
         
-        if save_frames:
-            theta = n.linspace(-n.pi,n.pi,100)
+        # First frame not saved in the checkpoint yet
+        saved = current
         
-        for i in xrange(nframes):
-            succ, frame = video.read()
-            frame = cv2.cvtColor(frame,cv2.COLOR_BGR2GRAY)
+        # Frames are dropped only if the video frame rate is known
+        if fps is None:
+            fps = video.fps
+        drop_frames = drop_frames and fps > 0
+        clock_start = timeit.default_timer()
+        
+        # Seeking the first frame to process
+        if video.seekable and (stop is None or current < stop):
+            video.seek(current)
+        
+        frames = range(current,stop) if stop is not None else itertools.count(current)
+        end = current
+        for i in frames:
+            
+            if i-start == len(fs):
+                # Growing the arrays for a source of unknown length
+                grow = max(len(fs),64)
+                fs = n.concatenate((fs,n.empty(grow,dtype=self.feature)))
+                converged = n.concatenate((converged,n.ones(grow,dtype=bool)))
             
-            if succ: # If successfully got the video frame
+            # Skipping the frame without decoding it if the processing 
+            # is more than a frame behind the video
+            if drop_frames and timeit.default_timer()-clock_start > (i+1-current)/fps:
+                if not(video.skip()):
+                    if nframes is None: # End of a source of unknown length
+                        break
+                    raise RuntimeError("Error in retrieving video frames.")
+                fs[i-start] = None
+                converged[i-start] = False
+            
+            else:
+                frame = video.read()
                 
-                try:
-                    feature,_percent = self.image_search(frame)
-                    fs[i] = feature
+                if frame is not None: # If successfully got the video frame
                     
-                    if save_frames:
-                        plt.imshow(frame, cmap='gray')
-                        plt.plot(feature.yc + feature.radius*n.cos(theta), feature.xc + feature.radius*n.sin(theta),'r-',linewidth=2)
-                        plt.axis('off')
-                        plt.savefig('Frame_'+str(i))
-                        plt.close()
+                    try:
+                        feature,_percent,converged[i-start] = \
+                            self.image_search(frame,time_budget,self._frame_rng(i),
+                                              return_converged=True)
+                        fs[i-start] = feature
                         
-                except ValueError:
-                    fs[i] = None
-                
-            else:
-                raise RuntimeError("Error in retrieving video frames.")
+                        if save_frames and feature is not None:
+                            _save_frame(frame,feature,'Frame_'+str(i))
+                            
+                    except ValueError:
+                        fs[i-start] = None
+                    
+                elif nframes is None: # End of a source of unknown length
+                    break
+                else:
+                    raise RuntimeError("Error in retrieving video frames.")
+            
+            end = i+1
             
-        return fs        
\ No newline at end of file
+            if checkpoint is not None and (i+1-start) % checkpoint_every == 0:
+                _save_checkpoint(checkpoint,saved,fs[saved-start:i+1-start],
+                                 converged[saved-start:i+1-start])
+                saved = i+1
+        
+        video.release()
+        
+        if nframes is None:
+            fs = fs[:end-start]
+            converged = converged[:end-start]
+        
+        if checkpoint is not None and saved < stop:
+            _save_checkpoint(checkpoint,saved,fs[saved-start:],converged[saved-start:])
+        
+        self.frames_converged = converged
+        return fs
+
+
+def _save_frame(frame,feature,filename):
+    ''' Save a frame with the feature superimposed. The feature is drawn
+    through its print_feature method: features that need an interval 
+    (e.g. lines) are drawn over the whole frame diagonal.
+    '''
+    if feature.print_interval:
+        # Unbounded features are printed across the whole frame
+        diag = n.hypot(*frame.shape[:2])
+        with n.errstate(invalid='ignore'):
+            x,y = feature.print_feature(100,-diag,diag)
+    else:
+        x,y = feature.print_feature(100)
+    
+    # Reverted x,y because image[:,0] is the vertical axis
+    plt.imshow(frame, cmap='gray')
+    plt.plot(y,x,'r-',linewidth=2)
+    plt.xlim(0,frame.shape[1])
+    plt.ylim(frame.shape[0],0)
+    plt.axis('off')
+    plt.savefig(filename)
+    plt.close()
+
+def _percent(feature,pixels,dst):
+    ''' Percentage of "fitness" of a feature (i.e inliers/total_points).
+    '''
+    # Compute distance of all non-zero points from the feature 
+    distances = feature.points_distance(pixels)
+    
+    # Count how many points are inliers (i.e. near the feature)
+    inliers = n.size(n.nonzero(distances <= dst)[0])
+    
+    return inliers/n.size(pixels)
+
+def _init_checkpoint(path,header):
+    ''' Create the checkpoint of a :py:meth:`RansacFeature.video_processing`
+    run, with a header that contains its frame range, detection parameters
+    and source signature. The header is written to a temporary file that is
+    then renamed, so that an interruption never leaves a corrupted header.
+    '''
+    tmp = path+'.tmp'
+    with open(tmp,'wb') as f:
+        pickle.dump(header,f,pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp,path)
+
+def _save_checkpoint(path,first,fs,converged):
+    ''' Append to the checkpoint the results of the frames from first on.
+    Only the frames processed since the last save are written, so the cost
+    of a save does not grow with the length of the video.
+    '''
+    chunk = {'first':first,'features':fs,'converged':converged}
+    with open(path,'ab') as f:
+        pickle.dump(chunk,f,pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    
+def _load_checkpoint(path,truncate=False):
+    ''' Load the state saved by :py:func:`_init_checkpoint` and 
+    :py:func:`_save_checkpoint`, rebuilding the arrays of features and
+    convergence flags from the saved chunks. A chunk torn by an interruption
+    is discarded and, if truncate is True (i.e. when resuming), also removed
+    from the file. Returns None if the checkpoint file does not exist.
+    '''
+    if not os.path.exists(path):
+        return None
+    
+    chunks = []
+    with open(path,'rb') as f:
+        state = pickle.load(f)
+        end = f.tell()
+        while True:
+            try:
+                chunks.append(pickle.load(f))
+            except (EOFError,pickle.UnpicklingError,AttributeError,
+                    ImportError,IndexError,ValueError):
+                break
+            end = f.tell()
+    
+    # Dropping the torn chunk, if any, so that new chunks are appended
+    # right after the last complete one
+    if truncate and end < os.path.getsize(path):
+        with open(path,'r+b') as f:
+            f.truncate(end)
+    
+    start,stop = state['start'],state['stop']
+    fs = n.empty(stop-start,dtype=object)
+    converged = n.ones(stop-start,dtype=bool)
+    state['next'] = start
+    for chunk in chunks:
+        first = chunk['first']-start
+        last = first+len(chunk['features'])
+        fs[first:last] = chunk['features']
+        converged[first:last] = chunk['converged']
+        state['next'] = start+last
+    
+    state['features'] = fs
+    state['converged'] = converged
+    return state
+
+def merge_shards(shards):
+    ''' Merge the outputs of :py:meth:`RansacFeature.video_processing` 
+    runs over different frame ranges of the same video.
+    
+    Args:
+        shards (list): list of shards. Each shard is either the path (str or
+            :py:class:`os.PathLike`) of a
+            completed checkpoint file or a (start,fs) tuple, where start is
+            the first frame of the shard and fs the array of features
+            returned by :py:meth:`RansacFeature.video_processing`.
+            
+    Returns:
+        fs (numpy.ndarray): the array of features of the whole frame range
+            covered by the shards, in frame order.
+            
+    Raises:
+        ValueError: If a checkpoint is not completed, if the checkpoints
+            were saved with different videos or detection parameters or if 
+            the shards do not cover a contiguous frame range.
+    '''
+    parts = []
+    run = None
+    for shard in shards:
+        if isinstance(shard,(str,os.PathLike)):
+            state = _load_checkpoint(shard)
+            if state is None or state['next'] != state['stop']:
+                raise ValueError('Checkpoint {0} is not completed'.format(shard))
+            if run is None:
+                run = (state['params'],state['source'])
+            elif run != (state['params'],state['source']):
+                raise ValueError('Checkpoint {0} was saved with a different video\
+                                 or different detection parameters'.format(shard))
+            parts.append((state['start'],state['features']))
+        else:
+            start,fs = shard
+            parts.append((start,fs))
+    
+    if not(parts):
+        raise ValueError('No shards to merge')
+    
+    parts.sort(key=lambda part: part[0])
+    
+    # Shards must be contiguous, without gaps or overlaps
+    for (start,fs),(next_start,_fs) in zip(parts[:-1],parts[1:]):
+        if start+len(fs) != next_start:
+            raise ValueError('Shards are not contiguous: frame {0} expected, \
+                             frame {1} found'.format(start+len(fs),next_start))
+    
+    return n.concatenate([fs for _start,fs in parts])
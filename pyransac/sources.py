@@ -0,0 +1,285 @@
+from __future__ import division
+import abc
+import hashlib
+import os
+import cv2
+import numpy as n
+
+
+class FrameSource(object):
+    '''
+    Abstract class that represents a sequence of grayscale frames to be
+    processed with :py:meth:`pyransac.ransac.RansacFeature.video_processing`
+
+    Attributes:
+        fps(float): the frame rate of the source, 0 if unknown.
+        seekable(bool): False if the frames can only be read in sequence.
+    '''
+    __metaclass__ = abc.ABCMeta
+
+    fps = 0
+    seekable = True
+
+    @abc.abstractmethod
+    def __len__(self):
+        pass
+
+    @abc.abstractmethod
+    def seek(self,index):
+        '''
+        This method moves the source to a frame, so that it is the
+        next one to be read.
+
+        Args:
+            index (int): the index of the frame.
+        '''
+
+        pass
+
+    @abc.abstractmethod
+    def read(self):
+        '''
+        This method reads the next frame.
+
+        Returns:
+            frame (numpy.ndarray): the grayscale frame or None if the frame
+                cannot be retrieved.
+        '''
+
+        pass
+
+    def frame_count(self):
+        '''
+        This method returns the number of frames of the source.
+        
+        Returns:
+            count (int): the number of frames, None if unknown.
+        '''
+        
+        return len(self)
+    
+    def signature(self):
+        '''
+        This method returns a description of the frames of the source, 
+        used to check that a checkpoint refers to the same frames.
+        
+        Returns:
+            signature (tuple): the description of the source.
+            
+        Raises:
+            ValueError: If the source has no stable identity, so that a
+                checkpoint could be resumed on different frames.
+        '''
+        
+        raise ValueError('{0} has no stable identity'.format(type(self).__name__))
+    
+    def skip(self):
+        '''
+        This method moves the source to the next frame without
+        reading the current one.
+
+        Returns:
+            succ (bool): True if the frame was skipped successfully.
+        '''
+
+        return self.read() is not None
+
+    def release(self):
+        '''
+        This method releases the resources held by the source.
+        '''
+
+        pass
+
+
+class VideoSource(FrameSource):
+    '''
+    Frame source for a video read through :py:class:`cv2.VideoCapture`.
+    The frames are converted to grayscale. Captures without a frame 
+    count (e.g. live cameras) are read in sequence until exhausted.
+
+    Args:
+        video (str): path string of the video file or an already opened
+            :py:class:`cv2.VideoCapture` object.
+    '''
+
+    def __init__(self,video):
+        # Only a capture opened here is released by the source
+        self._owned = isinstance(video,str)
+        self.path = None
+        if self._owned:
+            self.path = os.path.abspath(video)
+            video = cv2.VideoCapture(video)
+        self.video = video
+        self.fps = video.get(cv2.CAP_PROP_FPS)
+        self.seekable = len(self) > 0
+
+    def __len__(self):
+        return max(int(self.video.get(cv2.CAP_PROP_FRAME_COUNT)),0)
+    
+    def frame_count(self):
+        return len(self) if self.seekable else None
+
+    def signature(self):
+        # A capture opened elsewhere cannot be told apart from another one
+        if self.path is None:
+            raise ValueError('A capture object has no stable identity, open\
+                             the video from its path to use a checkpoint')
+        return ('video',self.path,os.path.getsize(self.path),len(self))
+    
+    def seek(self,index):
+        self.video.set(cv2.CAP_PROP_POS_FRAMES,index)
+
+    def read(self):
+        succ,frame = self.video.read()
+        if not(succ):
+            return None
+        return cv2.cvtColor(frame,cv2.COLOR_BGR2GRAY)
+
+    def skip(self):
+        # Grabbing without decoding the frame
+        return self.video.grab()
+
+    def release(self):
+        if self._owned:
+            self.video.release()
+
+
+class ArraySource(FrameSource):
+    '''
+    Frame source for frames already in memory (or memory-mapped), e.g.
+    a (n,h,w) numpy array of grayscale frames, a (n,h,w,3) numpy array of
+    BGR frames or a list of frames. Grayscale frames are returned as views,
+    without copying them.
+
+    Args:
+        frames (numpy.ndarray): the stack of frames.
+        fps (float): the frame rate of the frames, 0 if unknown.
+    '''
+
+    def __init__(self,frames,fps=0):
+        self.frames = frames
+        self.fps = fps
+        self._next = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def signature(self):
+        shape = getattr(self.frames,'shape',(len(self.frames),))
+        dtype = getattr(self.frames,'dtype',None)
+        filename = getattr(self.frames,'filename',None)
+        
+        # Fingerprint of the content: the first, middle and last frames
+        h = hashlib.sha1()
+        count = len(self.frames)
+        for i in sorted(set([0,count//2,count-1])):
+            if i >= 0:
+                h.update(n.ascontiguousarray(self.frames[i]).tobytes())
+        return ('array',tuple(shape),str(dtype),filename,h.hexdigest())
+    
+    def seek(self,index):
+        self._next = index
+
+    def read(self):
+        if self._next >= len(self.frames):
+            return None
+
+        frame = self.frames[self._next]
+        self._next += 1
+
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(n.asarray(frame),cv2.COLOR_BGR2GRAY)
+        return frame
+
+    def skip(self):
+        if self._next >= len(self.frames):
+            return False
+        self._next += 1
+        return True
+
+
+class IterableSource(FrameSource):
+    '''
+    Frame source for frames that can only be read in sequence, e.g. 
+    a generator or an iterator of (h,w) grayscale or (h,w,3) BGR frames.
+    The number of frames is unknown and the source cannot seek.
+
+    Args:
+        frames: the iterable of frames.
+        fps (float): the frame rate of the frames, 0 if unknown.
+    '''
+
+    seekable = False
+
+    def __init__(self,frames,fps=0):
+        self.frames = iter(frames)
+        self.fps = fps
+        self._next = 0
+
+    def __len__(self):
+        raise TypeError('A sequential source has no length')
+
+    def frame_count(self):
+        return None
+
+    def signature(self):
+        raise ValueError('A sequential source has no signature')
+
+    def seek(self,index):
+        if index != self._next:
+            raise ValueError('A sequential source cannot seek')
+
+    def read(self):
+        frame = next(self.frames,None)
+        if frame is None:
+            return None
+        self._next += 1
+
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(n.asarray(frame),cv2.COLOR_BGR2GRAY)
+        return frame
+
+
+def raw_source(path,shape,dtype=n.uint8,offset=0,fps=0):
+    '''
+    Open a raw dump of frames (e.g. the output of an acquisition system)
+    as a memory-mapped :py:class:`ArraySource`. The frames are read
+    directly from the file, without decoding or copying them.
+
+    Args:
+        path (str): path string of the raw file.
+        shape (tuple): the shape of the stack of frames, (n,h,w) or (n,h,w,3).
+        dtype (numpy.dtype): the type of the pixels.
+        offset (int): the number of header bytes before the first frame.
+        fps (float): the frame rate of the frames, 0 if unknown.
+
+    Returns:
+        source (:py:class:`ArraySource`): the source of the frames.
+    '''
+
+    frames = n.memmap(path,dtype=dtype,mode='r',offset=offset,shape=shape)
+    return ArraySource(frames,fps)
+
+
+def as_source(frames):
+    '''
+    Wrap frames in the proper :py:class:`FrameSource`.
+
+    Args:
+        frames: a :py:class:`FrameSource`, a path string of a video file,
+            a :py:class:`cv2.VideoCapture` object, a stack of frames
+            (e.g. a numpy array or a :py:class:`numpy.memmap`) or any other
+            iterable of frames.
+
+    Returns:
+        source (:py:class:`FrameSource`): the source of the frames.
+    '''
+
+    if isinstance(frames,FrameSource):
+        return frames
+    if isinstance(frames,str) or hasattr(frames,'grab'):
+        return VideoSource(frames)
+    if hasattr(frames,'__len__') and hasattr(frames,'__getitem__'):
+        return ArraySource(frames)
+    return IterableSource(frames)
@@ -0,0 +1,54 @@
+import cv2
+import numpy as n
+from pyransac.cache import ResultCache
+from pyransac.ransac import RansacFeature
+from pyransac.features import Circle
+
+
+def make_image(radius=30):
+    image = n.zeros((120,120),dtype=n.uint8)
+    cv2.circle(image,(60,60),radius,255,1)
+    return image
+
+
+def test_lru_eviction():
+    cache = ResultCache(maxsize=2)
+    cache.put('a',1)
+    cache.put('b',2)
+    assert cache.get('a') == 1    # 'b' is now the least recently used
+    cache.put('c',3)
+
+    assert len(cache) == 2
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert (cache.hits,cache.misses) == (3,1)
+
+def test_disk_tier(tmp_path):
+    ResultCache(directory=str(tmp_path)).put('a',(None,0.5))
+
+    # A fresh cache finds the result on disk and keeps it in memory
+    cache = ResultCache(directory=str(tmp_path))
+    assert cache.get('a') == (None,0.5)
+    assert len(cache) == 1
+    assert (cache.hits,cache.misses) == (1,0)
+
+def test_key_depends_on_parameters():
+    image = make_image()
+    first = RansacFeature(Circle,dst=2)
+    second = RansacFeature(Circle,dst=3)
+
+    assert ResultCache.key(image,first._params()) == ResultCache.key(image,first._params())
+    assert ResultCache.key(image,first._params()) != ResultCache.key(image,second._params())
+    assert ResultCache.key(image,first._params()) != \
+           ResultCache.key(make_image(20),first._params())
+
+def test_video_processing_repeated_frames():
+    frames = n.array([make_image()]*3 + [make_image(20)])
+    cache = ResultCache()
+    ransac = RansacFeature(Circle,max_it=50,dst=2,seed=0,cache=cache)
+    fs = ransac.video_processing(frames)
+
+    assert (cache.hits,cache.misses) == (2,2)
+    assert fs[1] is fs[0]
+    assert abs(fs[3].radius-20) < 2
@@ -0,0 +1,111 @@
+import pickle
+import time
+import timeit
+import cv2
+import numpy as n
+from pyransac.cache import ResultCache
+from pyransac.ransac import RansacFeature, merge_shards
+from pyransac.sources import ArraySource
+from pyransac.features import Circle
+
+
+def make_image(size=400):
+    image = n.zeros((size,size),dtype=n.uint8)
+    cv2.circle(image,(size//2,size//2),size//3,255,1)
+    return image
+
+def make_ransac(**kwargs):
+    # The stop criterion is never met, only the deadline ends the loop
+    return RansacFeature(Circle,max_it=10**7,inliers_percent=2,dst=2,seed=0,**kwargs)
+
+
+class SlowSource(ArraySource):
+    ''' Array source that takes some time to read each frame. '''
+
+    def read(self):
+        time.sleep(0.03)
+        return ArraySource.read(self)
+
+
+def test_detect_feature_deadline():
+    image = make_image()
+    pixels = n.transpose(n.nonzero(image))
+    ransac = make_ransac()
+
+    start = timeit.default_timer()
+    feature,_percent,converged = ransac.detect_feature(pixels,time_budget=0.05,
+                                                       return_converged=True)
+    assert timeit.default_timer()-start < 1
+    assert feature is not None
+    assert not(converged)
+
+def test_detect_feature_converged():
+    image = make_image()
+    pixels = n.transpose(n.nonzero(image))
+    ransac = RansacFeature(Circle,max_it=20,dst=2,seed=0)
+
+    result = ransac.detect_feature(pixels,time_budget=10,return_converged=True)
+    assert result[2]
+    assert len(ransac.detect_feature(pixels)) == 2
+
+def test_detect_feature_deadline_without_feature():
+    # Collinear pixels: no sample defines a circle
+    pixels = n.column_stack((n.arange(0,300,3),n.arange(0,300,3)))
+    feature,percent,converged = make_ransac().detect_feature(pixels,time_budget=0.01,
+                                                             return_converged=True)
+    assert (feature,percent,converged) == (None,0,False)
+
+def test_pyramid_search_deadline():
+    ransac = make_ransac(pyramid_levels=2,refine_it=10**7)
+
+    start = timeit.default_timer()
+    feature,_percent,converged = ransac.image_search(make_image(),time_budget=0.1,
+                                                     return_converged=True)
+    assert timeit.default_timer()-start < 1
+    assert not(converged)
+    assert abs(feature.radius-400//3) < 3
+
+def test_drop_frames_slow_source():
+    frames = n.array([make_image(120)]*6)
+    ransac = RansacFeature(Circle,max_it=20,dst=2,seed=0)
+    fs = ransac.video_processing(SlowSource(frames,fps=100),drop_frames=True)
+
+    dropped = [f is None for f in fs]
+    assert any(dropped) and not(all(dropped))
+    assert list(ransac.frames_converged) == [not(d) for d in dropped]
+
+def test_drop_frames_fps(tmp_path):
+    frames = n.array([make_image(120)]*6)
+    checkpoint = str(tmp_path/'run.ckpt')
+    ransac = make_ransac()
+    fs = ransac.video_processing(frames,time_budget=0.02,drop_frames=True,fps=100,
+                                 checkpoint=checkpoint,checkpoint_every=1)
+
+    assert any(f is None for f in fs)
+    assert not(any(ransac.frames_converged))
+
+    # A chunk is saved for every frame, dropped or not
+    chunks = 0
+    with open(checkpoint,'rb') as f:
+        pickle.load(f)
+        while True:
+            try:
+                pickle.load(f)
+            except EOFError:
+                break
+            chunks += 1
+    assert chunks == len(frames)
+    assert [f is None for f in merge_shards([checkpoint])] == [f is None for f in fs]
+
+def test_drop_frames_unknown_fps():
+    frames = n.array([make_image(120)]*3)
+    ransac = make_ransac()
+    fs = ransac.video_processing(frames,time_budget=0.02,drop_frames=True)
+
+    assert all(f is not None for f in fs)
+
+def test_deadline_results_not_cached():
+    cache = ResultCache()
+    make_ransac(cache=cache).image_search(make_image(),time_budget=0.01)
+
+    assert len(cache) == 0
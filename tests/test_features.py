@@ -0,0 +1,81 @@
+import numpy as n
+from pyransac.features import Circle, Exponential, Line, Ellipse
+
+
+def test_circle_degenerate():
+    samples = n.array([[(0,0),(100,0),(0,100)],     # good
+                       [(0,0),(100,0),(200,1)],     # almost collinear
+                       [(0,0),(1,1),(0,100)],       # adjacent pixels
+                       [(0,0),(0,0),(0,100)]])      # repeated points
+    assert list(Circle.degenerate(samples)) == [False,True,True,True]
+
+def test_exponential_degenerate():
+    samples = n.array([[(1,2),(2,5),(3,10)],
+                       [(1,2),(1,5),(3,10)],
+                       [(1,2),(2,5),(3,4)]])
+    assert list(Exponential.degenerate(samples)) == [False,True,True]
+
+def ellipse_points(theta,xc=60,yc=40,a=30,b=15,phi=0.3):
+    ''' Points of the ellipse with center (xc,yc), axes a,b rotated by phi. '''
+    x = a*n.cos(theta)
+    y = b*n.sin(theta)
+    return n.column_stack((xc + x*n.cos(phi) - y*n.sin(phi),
+                           yc + x*n.sin(phi) + y*n.cos(phi)))
+
+def test_line_fit():
+    params,valid = Line._fit(n.array([[(0.,3.),(4.,3.)],[(1.,1.),(5.,5.)]]))
+    assert valid.all()
+
+    # y = 3 and x - y = 0, up to the sign of the normal
+    nx,ny,c = params[0]*n.sign(params[0][1])
+    assert n.allclose((nx,ny,c),(0,1,3))
+    assert n.isclose(params[1][0],-params[1][1]) and n.isclose(params[1][2],0)
+
+def test_line_from_samples_masks():
+    samples = n.array([[(0,0),(10,5)],     # good
+                       [(3,3),(3,3)],      # coincident points
+                       [(3,3),(4,4)]])     # adjacent pixels
+    lines = Line.from_samples(samples)
+
+    assert lines[0] is not None and lines[1:] == [None,None]
+    assert n.allclose(lines[0].points_distance(samples[0].astype(float)),0)
+
+def test_line_scaled():
+    points = n.array([(2.,7.),(9.,-4.)])
+    line = Line(points).scaled(2)
+    assert n.allclose(line.points_distance(2*points),0)
+
+def test_ellipse_fit():
+    points = ellipse_points(n.linspace(0,2*n.pi,5,endpoint=False))
+    conics,valid = Ellipse._fit(points[n.newaxis])
+    assert valid[0]
+
+    # Conic of the same ellipse, from its center, axes and angle
+    A = n.cos(0.3)**2/30**2 + n.sin(0.3)**2/15**2
+    B = 2*n.sin(0.3)*n.cos(0.3)*(1/30**2 - 1/15**2)
+    C = n.sin(0.3)**2/30**2 + n.cos(0.3)**2/15**2
+    D = -2*A*60 - B*40
+    E = -B*60 - 2*C*40
+    F = A*60**2 + B*60*40 + C*40**2 - 1
+    expected = n.array([A,B,C,D,E,F])
+    expected /= n.linalg.norm(expected)*n.sign(A)
+
+    assert n.allclose(conics[0]*n.sign(conics[0][0]),expected)
+
+def test_ellipse_from_samples_masks():
+    good = ellipse_points(n.linspace(0,2*n.pi,5,endpoint=False))
+    collinear = n.array([(0,0),(20,0),(40,0),(10,30),(30,50)])
+    # Points on the hyperbola x*y = 100
+    hyperbola = n.array([(x,100/x) for x in (5,10,20,-5,-10)])
+    adjacent = n.array([(0,0),(1,0),(40,0),(10,30),(30,50)])
+    ellipses = Ellipse.from_samples(n.array([good,collinear,hyperbola,adjacent]))
+
+    assert ellipses[0] is not None and ellipses[1:] == [None,None,None]
+    assert not(Ellipse.degenerate(hyperbola[n.newaxis])[0])
+    assert n.allclose(ellipses[0].points_distance(good),0)
+
+def test_ellipse_scaled():
+    points = ellipse_points(n.linspace(0,2*n.pi,5,endpoint=False))
+    ellipse = Ellipse(points).scaled(2)
+    assert n.allclose(ellipse.points_distance(2*points),0)
+    assert n.allclose(ellipse.points_distance(2*ellipse_points(n.linspace(0,6,20))),0)
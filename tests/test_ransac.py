@@ -0,0 +1,217 @@
+import cv2
+import numpy as n
+import pytest
+from pyransac.ransac import RansacFeature, merge_shards
+from pyransac.sources import ArraySource, VideoSource
+from pyransac.features import Circle, Ellipse, Line
+
+
+def make_frames(count=6,size=120):
+    ''' Stack of frames with a circle moving across them. '''
+    frames = n.zeros((count,size,size),dtype=n.uint8)
+    for i in range(count):
+        cv2.circle(frames[i],(40+5*i,60),30,255,1)
+    return frames
+
+def make_ransac():
+    return RansacFeature(Circle,max_it=50,dst=2,seed=1)
+
+def params(fs):
+    return [(f.radius,f.xc,f.yc) for f in fs]
+
+
+class InterruptedSource(ArraySource):
+    ''' Array source that fails after a number of frames. '''
+
+    def __init__(self,frames,fail_after):
+        ArraySource.__init__(self,frames)
+        self.fail_after = fail_after
+        self.reads = 0
+
+    def read(self):
+        if self.reads == self.fail_after:
+            raise KeyboardInterrupt
+        self.reads += 1
+        return ArraySource.read(self)
+
+
+def test_video_processing_array():
+    frames = make_frames()
+    fs = make_ransac().video_processing(frames)
+
+    assert len(fs) == len(frames)
+    for i,f in enumerate(fs):
+        assert abs(f.radius-30) < 2
+        assert abs(f.yc-(40+5*i)) < 2
+        assert abs(f.xc-60) < 2
+
+def test_shards_match_single_run():
+    frames = make_frames()
+    full = make_ransac().video_processing(frames)
+
+    first = make_ransac().video_processing(frames,start=0,stop=2)
+    second = make_ransac().video_processing(frames,start=2)
+    merged = merge_shards([(2,second),(0,first)])
+
+    assert params(merged) == params(full)
+
+def test_merge_shards_not_contiguous():
+    frames = make_frames()
+    first = make_ransac().video_processing(frames,start=0,stop=2)
+    last = make_ransac().video_processing(frames,start=3)
+
+    with pytest.raises(ValueError):
+        merge_shards([(0,first),(3,last)])
+
+def test_checkpoint_resume(tmp_path):
+    frames = make_frames()
+    checkpoint = str(tmp_path/'run.ckpt')
+    full = make_ransac().video_processing(frames)
+
+    source = InterruptedSource(frames,fail_after=5)
+    with pytest.raises(KeyboardInterrupt):
+        make_ransac().video_processing(source,checkpoint=checkpoint,checkpoint_every=2)
+
+    # Only the frames after the last checkpoint are processed again
+    source = InterruptedSource(frames,fail_after=len(frames))
+    fs = make_ransac().video_processing(source,checkpoint=checkpoint,checkpoint_every=2)
+
+    assert source.reads == 2
+    assert params(fs) == params(full)
+    assert params(merge_shards([checkpoint])) == params(full)
+
+def test_checkpoint_other_parameters(tmp_path):
+    frames = make_frames()
+    checkpoint = str(tmp_path/'run.ckpt')
+    make_ransac().video_processing(frames,checkpoint=checkpoint)
+
+    ransac = make_ransac()
+    ransac.dst = 5
+    with pytest.raises(ValueError):
+        ransac.video_processing(frames,checkpoint=checkpoint)
+    with pytest.raises(ValueError):
+        make_ransac().video_processing(frames[:,:100],checkpoint=checkpoint)
+
+def test_merge_checkpoint_shards(tmp_path):
+    frames = make_frames()
+    full = make_ransac().video_processing(frames)
+
+    shards = []
+    for start,stop in [(0,3),(3,6)]:
+        path = str(tmp_path/'shard_{0}.ckpt'.format(start))
+        make_ransac().video_processing(frames,start=start,stop=stop,
+                                       checkpoint=path,checkpoint_every=2)
+        shards.append(path)
+
+    assert params(merge_shards(shards)) == params(full)
+
+def test_pyramid_search_noisy_image():
+    rs = n.random.RandomState(0)
+    image = n.zeros((600,600),dtype=n.uint8)
+    cv2.circle(image,(300,280),180,255,1)
+    image[rs.rand(600,600) < 0.005] = 255
+
+    ransac = RansacFeature(Circle,max_it=100,dst=3,seed=0,pyramid_levels=2)
+    feature,_percent = ransac.image_search(image)
+
+    assert abs(feature.radius-180) < 2
+    assert abs(feature.xc-280) < 2
+    assert abs(feature.yc-300) < 2
+
+def test_pyramid_search_needs_scaling():
+    class Unscalable(Circle):
+        scalable = False
+
+    with pytest.raises(ValueError):
+        RansacFeature(Unscalable,pyramid_levels=1)
+
+def test_video_processing_iterator():
+    frames = make_frames()
+    full = make_ransac().video_processing(frames)
+
+    fs = make_ransac().video_processing(iter(list(frames)))
+    assert params(fs) == params(full)
+
+    fs = make_ransac().video_processing((frame for frame in frames),stop=4)
+    assert params(fs) == params(full[:4])
+
+def test_video_processing_iterator_cannot_seek(tmp_path):
+    frames = make_frames()
+    with pytest.raises(ValueError):
+        make_ransac().video_processing(iter(frames),start=2)
+    with pytest.raises(ValueError):
+        make_ransac().video_processing(iter(frames),checkpoint=str(tmp_path/'run.ckpt'))
+
+@pytest.mark.parametrize('feature',[Circle,Ellipse,Line])
+def test_video_processing_save_frames(feature,tmp_path,monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    ransac = RansacFeature(feature,max_it=20,dst=2,seed=1)
+    ransac.video_processing(make_frames(count=2),save_frames=True)
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['Frame_0.png','Frame_1.png']
+
+def test_seed_reproducible():
+    image = make_frames()[0]
+    for seed in (7,n.random.default_rng(7)):
+        first = RansacFeature(Circle,max_it=20,dst=2,seed=seed).image_search(image)[0]
+        if not(isinstance(seed,int)):
+            seed = n.random.default_rng(7)
+        second = RansacFeature(Circle,max_it=20,dst=2,seed=seed).image_search(image)[0]
+        assert params([first]) == params([second])
+
+def test_spawned_streams_independent_of_frames():
+    ransac = make_ransac()
+    draws = [rng.integers(1<<30,size=4).tolist() for rng in ransac.spawn(3)]
+    frames = [ransac._frame_rng(i).integers(1<<30,size=4).tolist() for i in range(3)]
+
+    assert not(set(map(tuple,draws)) & set(map(tuple,frames)))
+
+def test_checkpoint_other_frames(tmp_path):
+    checkpoint = str(tmp_path/'run.ckpt')
+    make_ransac().video_processing(make_frames(count=4),checkpoint=checkpoint)
+
+    # Same shape and type, different circles
+    frames = n.zeros((4,120,120),dtype=n.uint8)
+    for i in range(4):
+        cv2.circle(frames[i],(60,60),20,255,1)
+    with pytest.raises(ValueError):
+        make_ransac().video_processing(frames,checkpoint=checkpoint)
+
+def test_checkpoint_capture_without_identity(tmp_path):
+    class Capture(object):
+        def get(self,prop):
+            return 4
+
+    source = VideoSource(Capture())
+    with pytest.raises(ValueError):
+        make_ransac().video_processing(source,checkpoint=str(tmp_path/'run.ckpt'))
+
+def test_merge_shards_read_only(tmp_path):
+    frames = make_frames()
+    path = tmp_path/'run.ckpt'
+    full = make_ransac().video_processing(frames,checkpoint=path,checkpoint_every=2)
+
+    # A torn chunk at the end of a completed checkpoint is left untouched
+    with open(path,'ab') as f:
+        f.write(b'torn')
+    size = path.stat().st_size
+
+    assert params(merge_shards([path])) == params(full)
+    assert path.stat().st_size == size
+
+def test_detect_feature_all_degenerate():
+    class CountingCircle(Circle):
+        checked = 0
+
+        @classmethod
+        def degenerate(cls,samples):
+            CountingCircle.checked += len(samples)
+            return Circle.degenerate(samples)
+
+    # All the pixels on a line: every sample is rejected
+    pixels = n.column_stack((n.arange(0,300,3),n.arange(0,300,3)))
+    ransac = RansacFeature(CountingCircle,max_it=150,seed=0)
+
+    with pytest.raises(ValueError):
+        ransac.detect_feature(pixels)
+    assert CountingCircle.checked == ransac.max_it+1
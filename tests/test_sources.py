@@ -0,0 +1,49 @@
+import cv2
+import numpy as n
+from pyransac.ransac import RansacFeature
+from pyransac.sources import ArraySource, IterableSource, as_source, raw_source
+from pyransac.features import Circle
+
+
+def make_frames(count=4,size=120):
+    frames = n.zeros((count,size,size),dtype=n.uint8)
+    for i in range(count):
+        cv2.circle(frames[i],(40+5*i,60),30,255,1)
+    return frames
+
+def make_ransac():
+    return RansacFeature(Circle,max_it=50,dst=2,seed=1)
+
+
+def test_as_source():
+    frames = make_frames()
+    assert isinstance(as_source(frames),ArraySource)
+    assert isinstance(as_source(list(frames)),ArraySource)
+    assert isinstance(as_source(iter(frames)),IterableSource)
+
+def test_raw_source_memmap_views(tmp_path):
+    frames = make_frames()
+    path = str(tmp_path/'frames.raw')
+    frames.tofile(path)
+
+    source = raw_source(path,frames.shape)
+    frame = source.read()
+
+    # The frame is a view of the memory-mapped file, not a copy
+    assert isinstance(source.frames,n.memmap)
+    assert n.shares_memory(frame,source.frames)
+    assert (frame == frames[0]).all()
+
+    source.seek(0)
+    fs = make_ransac().video_processing(source)
+    expected = make_ransac().video_processing(frames)
+    assert [f.radius for f in fs] == [f.radius for f in expected]
+
+def test_iterator_exhausted_before_stop():
+    frames = make_frames()
+    ransac = make_ransac()
+    fs = ransac.video_processing(iter(frames),stop=10)
+
+    assert len(fs) == len(frames)
+    assert len(ransac.frames_converged) == len(frames)
+    assert all(abs(f.radius-30) < 2 for f in fs)